@@ -1,13 +1,19 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+
+#
+# Heavyweight modules (jira and friends) are imported lazily inside the
+# functions that need them, so --help and argparse error paths don't pay
+# their startup cost.
 
 import getpass
 import sys
 import argparse
-import fileinput
-import pprint
+import concurrent.futures
+import functools
 import os
-import ConfigParser
-import jira
+import shelve
+import threading
+import time
 
 
 # module level varibale to hold jira connection
@@ -15,6 +21,30 @@ conn = None
 # module level variable to hold cmdline args
 args = None
 
+# on-disk cache of ticket data and search results between invocations
+CACHE_DIR = os.path.join( os.environ[ 'HOME' ], '.cache', 'jiracmdline' )
+ISSUE_TTL = 300
+SEARCH_TTL = 60
+# shelve is not thread-safe, serialize access from the worker threads
+_cache_lock = threading.Lock()
+
+# output templates for format_issue, built once instead of per ticket
+_SEP = '-'*50
+_CAT_TMPL = ( 'Ticket: {ticket}\n'
+              'Summary: {summary}\n'
+              'Description: {desc}\n'
+              'Comments: \n{comments}\n\n' )
+_LIST_TMPL = '{0:8s}  {1}\n'
+
+
+@functools.lru_cache( maxsize=4 )
+def _load_cfg( path, mtime ):
+    # mtime is part of the cache key so an edited file is re-read
+    import configparser
+    cfg = configparser.ConfigParser()
+    cfg.read( path )
+    return dict( cfg.items( "Connection" ) )
+
 
 def parse_cmdline():
     desc = "List or modify jira tickets."
@@ -35,6 +65,10 @@ def parse_cmdline():
     parser.add_argument("-d", "--debug",
                         action='store_true',
                         help="Print Debugging Information" )
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=8,
+                        help="Number of parallel connections to the jira server. (Default: %(default)s)" )
     conngroup = parser.add_argument_group( 'Connection Options' )
     conngroup.add_argument("-s", "--jiraserver",
                         help="Jira server to connect to. (cmdline or cfgfile)" )
@@ -89,9 +123,7 @@ def parse_cmdline():
     # read defaults from config file
     cfgoptions = {}
     if os.path.isfile( args.cfgfile ):
-        cfg = ConfigParser.SafeConfigParser()
-        cfg.read( args.cfgfile )
-        cfgoptions = dict( cfg.items( "Connection" ) )
+        cfgoptions = _load_cfg( args.cfgfile, os.stat( args.cfgfile ).st_mtime )
     # use defaults for missing options (cmdline always overrides defaults)
     for k in [ 'jiraserver', 'jirauser', 'jiraproject' ]:
         if not getattr( args, k ):
@@ -99,11 +131,23 @@ def parse_cmdline():
                 setattr( args, k, cfgoptions[ k ] )
             except ( KeyError ) as e:
                 raise SystemExit( "Missing required option '{0}'".format( k ) )
+    # project is known now; compile the jql strings once so do_search is
+    # a straight lookup and the disk cache keys stay stable
+    args._jql_mine = ( 'assignee=currentUser() and '
+                       'project={project} and '
+                       'status in ("open","in progress")'
+                       ).format( project=args.jiraproject )
+    args._jql_all = ( 'project={project} and '
+                      'status in ("open")'
+                      ).format( project=args.jiraproject )
+    # only check stdin once; both the password prompt and the ticketlist
+    # drain below depend on it
+    stdin_is_tty = sys.stdin.isatty()
     # get password
     if not args.jirapass:
         if 'jirapass' in cfgoptions:
             args.jirapass = cfgoptions[ 'jirapass' ]
-        elif sys.stdin.isatty():
+        elif stdin_is_tty:
             args.jirapass = getpass.getpass()
         else:
             raise SystemExit( "Missing jira password" )
@@ -112,9 +156,10 @@ def parse_cmdline():
         raise SystemExit( "Givetouser is required with 'Give' option" )
     # Check for ticketlist on stdin
     # isatty() returns false if there's something in stdin
-    if not sys.stdin.isatty():
-        for elem in fileinput.input( '-' ):
-            args.ticketlist.append( elem )
+    if not stdin_is_tty:
+        # split() also strips the trailing newlines that fileinput kept,
+        # which otherwise end up in the ticket id's sent to the server
+        args.ticketlist.extend( sys.stdin.read().split() )
     # These options require tickets id's to be specified
     if args.give or args.take or args.resolve or args.comment:
         if len( args.ticketlist ) < 1:
@@ -123,87 +168,195 @@ def parse_cmdline():
 
 
 def jira_connect():
+    import jira.client
+    import requests.adapters
     opts = { 'server': args.jiraserver }
-    return jira.client.JIRA( opts, basic_auth=( args.jirauser,args.jirapass ) )
+    if not ( args.comment or args.resolve or args.take or args.give ):
+        # list paths paginate search results; fetch the pages concurrently
+        opts[ 'async' ] = True
+        opts[ 'async_workers' ] = args.workers
+    j = jira.client.JIRA( opts, basic_auth=( args.jirauser,args.jirapass ) )
+    # size the connection pool for the worker threads so they share
+    # pooled keep-alive connections instead of paying a tls handshake
+    # per request
+    j._session.headers.update( { 'Connection': 'keep-alive' } )
+    adapter = requests.adapters.HTTPAdapter( pool_connections=10, pool_maxsize=20 )
+    j._session.mount( 'https://', adapter )
+    return j
+
+
+def _cache_open():
+    if not os.path.isdir( CACHE_DIR ):
+        os.makedirs( CACHE_DIR )
+    return shelve.open( os.path.join( CACHE_DIR, 'cache' ) )
+
+
+def _cache_get( key, ttl ):
+    with _cache_lock, _cache_open() as db:
+        try:
+            stamp, data = db[ key ]
+        except ( KeyError ) as e:
+            return None
+        if time.time() - stamp > ttl:
+            # stale entries are useless, evict them instead of letting
+            # the shelf grow forever
+            del db[ key ]
+            return None
+        return data
+
+
+def _cache_set( key, data ):
+    with _cache_lock, _cache_open() as db:
+        db[ key ] = ( time.time(), data )
 
 
+def _cache_del( key ):
+    with _cache_lock, _cache_open() as db:
+        db.pop( key, None )
+
+
+def cached_issue( key, ttl=ISSUE_TTL ):
+    # tickets change rarely; serve from the disk cache within the ttl and
+    # rebuild the Issue from its stored json
+    import jira.resources
+    # normalize so 'bwstor-1' and 'BWSTOR-1' hit the same entry, and so
+    # reads and writes agree on one key
+    key = key.upper()
+    raw = _cache_get( 'issue:' + key, ttl )
+    if raw is not None:
+        return jira.resources.Issue( conn._options, conn._session, raw=raw )
+    issue = conn.issue( key )
+    _cache_set( 'issue:' + key, issue.raw )
+    return issue
+
+
+def _fetch_issues( keys, workers=8 ):
+    # each uncached fetch is a blocking https round-trip, so run them in
+    # parallel threads and yield each issue as its fetch completes; the
+    # first line of output appears after one round-trip instead of the
+    # whole batch (order follows completion, not the input list)
+    with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as ex:
+        futures = [ ex.submit( cached_issue, key ) for key in keys ]
+        for future in concurrent.futures.as_completed( futures ):
+            yield future.result()
+
+
+@functools.lru_cache( maxsize=256 )
 def search_users( name ):
+    # memoized; repeated lookups for the same name skip the http call
     return conn.search_users( name )
 
 
+@functools.lru_cache( maxsize=256 )
 def is_valid_user( name ):
-    for u in search_users( name ):
-        if u.name == name:
-            return True
-    return False
+    # exact-match lookup returns one record, vs. up to 50 from search_users
+    import jira.exceptions
+    try:
+        return conn.user( name ) is not None
+    except ( jira.exceptions.JIRAError ) as e:
+        return False
 
 
 def do_search():
 #      for issue in jira.search_issues('assignee='+args.jira_user+' and project='+args.jira_project+' and status=open'):
-    searchstr = ( 'assignee=currentUser() and '
-                  'project={project} and '
-                  'status in ("open","in progress")' 
-                  ).format( project=args.jiraproject )
-    if args.list_all:
-        searchstr = ( 'project={project} and '
-                      'status in ("open")'
-                      ).format( project=args.jiraproject )
-    return conn.search_issues( searchstr )
+    searchstr = args._jql_all if args.list_all else args._jql_mine
+    # the plain list path only ever prints key and summary; --cat needs
+    # everything, including comments, prefetched in the same call
+    fields = 'summary'
+    expand = None
+    if args.cat:
+        fields = None
+        expand = 'comments,renderedFields'
+    import jira.resources
+    cachekey = 'jql:{0}:{1}:{2}'.format( searchstr, fields, expand )
+    # search results go stale faster than tickets, keep the ttl short
+    raws = _cache_get( cachekey, SEARCH_TTL )
+    if raws is not None:
+        return [ jira.resources.Issue( conn._options, conn._session, raw=r )
+                 for r in raws ]
+    issues = conn.search_issues( searchstr,
+                                 fields=fields,
+                                 expand=expand,
+                                 maxResults=False )
+    _cache_set( cachekey, [ i.raw for i in issues ] )
+    return issues
 #          pprint.pprint( str( issue ) )
 #          pprint.pprint( issue.raw )
 #          print ""
 #          raise SystemExit()
 
 
-def print_issue( issue ):
+def format_issue( issue ):
+    # returns a string rather than printing so callers can batch output
+    # into a single write
     if args.cat:
-        sep = '-'*50
-        comments = [ sep ]
+        comments = [ _SEP ]
         for comment in issue.fields.comment.comments:
-            c = conn.comment( issue.key, comment )
-            comments.append( '\n'.join( map( str, [ c.updateAuthor, c.body ] ) ) )
-            comments.append( sep )
-        print( 'Ticket: {ticket}\n'
-               'Summary: {summary}\n'
-               'Description: {desc}\n'
-               'Comments: \n{comments}\n'.format(
-               ticket=issue.key,
-               summary=issue.fields.summary,
-               desc=issue.fields.description,
-               comments='\n'.join( comments ) ) )
-    else:
-        print( '{0:8s}  {1}'.format( issue.key, issue.fields.summary ) )
+            # comment objects on the issue already carry author and body,
+            # no need for a separate GET per comment
+            comments.append( f'{comment.updateAuthor}\n{comment.body}' )
+            comments.append( _SEP )
+        return _CAT_TMPL.format(
+            ticket=issue.key,
+            summary=issue.fields.summary,
+            desc=issue.fields.description,
+            comments='\n'.join( comments ) )
+    return _LIST_TMPL.format( issue.key, issue.fields.summary )
 
 def add_comment( issue ):
     conn.add_comment( issue, args.comment )
-    print( 'Added comment: {0}'.format( args.comment ) )
+    return 'Added comment: {0}'.format( args.comment )
 
 
 def assign_issue( issue, new_user ):
     conn.assign_issue( issue, new_user )
-    print( "Assigned issue to user '{0}'".format( new_user ) )
+    return "Assigned issue to user '{0}'".format( new_user )
 
 
 def resolve_issue( issue ):
     conn.transition_issue(issue, '5')
-    print( "New state 'resolved'" )
+    return "New state 'resolved'"
+
+
+def _modify_one( tid ):
+    # runs in a worker thread, so buffer messages instead of printing
+    issue = conn.issue( tid )
+    msgs = []
+    if args.comment:
+        msgs.append( add_comment( issue ) )
+    if args.take:
+        msgs.append( assign_issue( issue, args.jirauser ) )
+    if args.give:
+        msgs.append( assign_issue( issue, args.givetouser ) )
+    if args.resolve:
+        msgs.append( resolve_issue( issue ) )
+    # the ticket changed on the server, drop any cached copy
+    _cache_del( 'issue:' + issue.key )
+    return ( issue, msgs )
 
 
 def do_modify():
-    for tid in args.ticketlist:
-        issue = conn.issue( tid )
-        print_issue( issue )
-        if args.comment:
-            add_comment( issue )
-        if args.take:
-            assign_issue( issue, args.jirauser )
-        if args.give:
-            if not is_valid_user( args.givetouser ):
-                raise SystemExit( "Invalid user: '{0}'".format( args.givetouser ) )
-            assign_issue( issue, args.givetouser )
-        if args.resolve:
-            resolve_issue( issue )
-        print( '' )
+    # validate the target user once, not once per ticket
+    if args.give and not is_valid_user( args.givetouser ):
+        raise SystemExit( "Invalid user: '{0}'".format( args.givetouser ) )
+    failures = 0
+    with concurrent.futures.ThreadPoolExecutor( max_workers=args.workers ) as ex:
+        futures = { ex.submit( _modify_one, tid ): tid for tid in args.ticketlist }
+        for future in concurrent.futures.as_completed( futures ):
+            # one failed ticket must not abort reporting for the others,
+            # whose modifications have already been applied
+            try:
+                issue, msgs = future.result()
+            except ( Exception ) as e:
+                sys.stderr.write( '{0}: {1}\n\n'.format( futures[ future ], e ) )
+                failures += 1
+                continue
+            # one write per ticket keeps its output contiguous
+            sys.stdout.write( ''.join(
+                [ format_issue( issue ) ] + [ m + '\n' for m in msgs ] + [ '\n' ] ) )
+    # exit non-zero so callers can detect partial failure
+    if failures > 0:
+        raise SystemExit( 1 )
 
 
 if __name__ == '__main__':
@@ -213,13 +366,15 @@ if __name__ == '__main__':
     if args.comment or args.resolve or args.take or args.give:
         do_modify()
     elif args.usersearch:
+        import pprint
         matches = search_users( args.usersearch )
         pprint.pprint( matches )
     else:
-        issues = []
-        if len( args.ticketlist ) > 0:
-            issues = [ conn.issue( tname ) for tname in args.ticketlist ]
+        # named tickets stream through the parallel fetcher; a search
+        # already yields full Issue objects and needs no refetch
+        if args.ticketlist:
+            issues = _fetch_issues( args.ticketlist, workers=args.workers )
         else:
-            issues = [ conn.issue( i.key ) for i in do_search() ]
+            issues = do_search()
         for issue in issues:
-            print_issue( issue )
+            sys.stdout.write( format_issue( issue ) )